@@ -1,7 +1,39 @@
+import asyncio
 import socket
-import threading
 import os
+import posixpath
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+def build_listing(path):
+    # Minimal LIST format (names only), coalesced into a single buffer for one send
+    buf = bytearray()
+    with os.scandir(path) as it:
+        for entry in it:
+            buf += entry.name.encode('utf-8')
+            buf += b'\r\n'
+    return buf
+
+def drain_pipe(r, fd, n, use_splice):
+    # Runs on the pool: move the n bytes waiting in pipe r into file fd. If the file side
+    # can't be spliced, the rest is copied with read/write so no data is lost.
+    # Returns whether splice still works for the next chunk.
+    while n and use_splice:
+        try:
+            n -= os.splice(r, fd, n, flags=os.SPLICE_F_MOVE)
+        except OSError:
+            use_splice = False
+    while n:
+        data = os.read(r, n)
+        os.write(fd, data)
+        n -= len(data)
+    return use_splice
 
 class CustomFTPServer:
     def __init__(self, host='0.0.0.0', port=2121, root_dir='data/files'):
@@ -11,184 +43,359 @@ class CustomFTPServer:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.running = False
+        self.loop = None
+        self.server = None
+        self.pasv_pool = None
+        # Fixed pool for blocking disk calls (open/write/scandir), reused for the server's lifetime
+        self.pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix='ftp')
         
         if not os.path.exists(self.root_dir):
             os.makedirs(self.root_dir)
 
     def start(self):
+        # Blocks the calling thread; one event loop multiplexes every client.
+        # Always a stock selector loop, never the process-wide policy's loop: uvicorn
+        # installs uvloop's policy, and uvloop lacks sock_sendfile.
+        loop = asyncio.SelectorEventLoop()
+        asyncio.set_event_loop(loop)
         try:
-            self.sock.bind((self.host, self.port))
-            self.sock.listen(5)
-            self.running = True
-            print(f"Custom FTP Server listening on {self.host}:{self.port}")
-            
-            while self.running:
-                try:
-                    client_sock, addr = self.sock.accept()
-                    print(f"FTP Connection from {addr}")
-                    handler = FTPHandler(client_sock, self.root_dir)
-                    threading.Thread(target=handler.handle, daemon=True).start()
-                except OSError:
-                    break
+            loop.run_until_complete(self.serve())
         except Exception as e:
             print(f"FTP Server Error: {e}")
+        finally:
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+
+    async def serve(self):
+        self.sock.bind((self.host, self.port))
+        self.loop = asyncio.get_running_loop()
+        self.loop.set_default_executor(self.pool)
+        self.pasv_pool = PassivePool(self.host)
+        # Deep backlog so bursts of clients aren't dropped before the loop accepts them
+        self.server = await asyncio.start_server(self.handle_client, sock=self.sock, backlog=128)
+        self.running = True
+        print(f"Custom FTP Server listening on {self.host}:{self.port}")
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.pasv_pool.close()
+
+    async def handle_client(self, reader, writer):
+        print(f"FTP Connection from {writer.get_extra_info('peername')}")
+        # Control replies are tiny: send them immediately instead of waiting on Nagle
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        await FTPHandler(reader, writer, self.root_dir, self.pasv_pool).handle()
 
     def stop(self):
         self.running = False
-        self.sock.close()
+        if self.loop and self.server:
+            self.loop.call_soon_threadsafe(self.server.close)
+        else:
+            self.sock.close()
+
+class PassivePool:
+    # Pre-bound PASV listeners shared by all clients, so a transfer doesn't pay for
+    # socket/bind/listen every time. size=0 disables pooling.
+    def __init__(self, host='0.0.0.0', size=16):
+        self.host = host
+        self.size = size
+        self.free = [self.new_listener() for _ in range(size)]
+
+    def new_listener(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.bind((self.host, 0))
+        sock.listen(1)
+        return sock
+
+    @staticmethod
+    def drain(sock):
+        # Idle pooled ports are reachable by anyone: drop whatever queued up meanwhile
+        while True:
+            try:
+                conn, addr = sock.accept()
+            except OSError:
+                break
+            conn.close()
+
+    def acquire(self):
+        if not self.free:
+            return self.new_listener()
+        # Random pick so the next PASV port can't be predicted from the previous one
+        sock = self.free.pop(random.randrange(len(self.free)))
+        self.drain(sock)
+        return sock
+
+    def release(self, sock):
+        self.drain(sock)
+        if len(self.free) < self.size:
+            self.free.append(sock)
+        else:
+            sock.close()
+
+    def close(self):
+        for sock in self.free:
+            sock.close()
+        self.free.clear()
 
 class FTPHandler:
-    def __init__(self, sock, root_dir):
-        self.sock = sock
+    # One instance per client; slots avoid a per-instance __dict__
+    __slots__ = ('reader', 'writer', 'root_dir', 'cwd', 'cwd_rel', 'authenticated', 'pasv_mode',
+                 'data_sock', 'data_addr', 'pasv_sock', 'pasv_pool')
+
+    def __init__(self, reader, writer, root_dir, pasv_pool=None):
+        self.reader = reader
+        self.writer = writer
         self.root_dir = os.path.abspath(root_dir)
         self.cwd = self.root_dir
+        self.cwd_rel = "/" # Client-visible path of cwd, kept in sync on CWD
         self.authenticated = False
         self.pasv_mode = False
         self.data_sock = None
         self.data_addr = None
         self.pasv_sock = None
+        self.pasv_pool = pasv_pool or PassivePool(size=0)
 
-    def send(self, msg):
+    async def send(self, msg):
+        # Fixed replies are passed as ready-made bytes (CRLF included); str gets encoded
+        if isinstance(msg, str):
+            msg = (msg + '\r\n').encode('utf-8')
         try:
-            self.sock.sendall((msg + '\r\n').encode('utf-8'))
-        except:
+            self.writer.write(msg)
+            await self.writer.drain()
+        except Exception:
             pass
 
-    def handle(self):
-        self.send("220 Welcome to Custom FTP Server")
+    async def handle(self):
+        await self.send(b"220 Welcome to Custom FTP Server\r\n")
         while True:
             try:
-                data = self.sock.recv(1024).decode('utf-8').strip()
-                if not data: break
-                print(f"FTP CMD: {data}")
+                # Commands are ASCII: parse on bytes, decode only the argument
+                line = (await self.reader.readline()).strip()
+                if not line: break
+                print(f"FTP CMD: {line.decode('utf-8', 'replace')}")
                 
-                cmd_parts = data.split(' ', 1)
-                cmd = cmd_parts[0].upper()
-                arg = cmd_parts[1] if len(cmd_parts) > 1 else ""
-
-                if cmd == "USER":
-                    self.send("331 Please specify the password.")
-                elif cmd == "PASS":
-                    self.authenticated = True # Accept any password for demo
-                    self.send("230 Login successful.")
-                elif not self.authenticated and cmd != "QUIT":
-                    self.send("530 Please login with USER and PASS.")
+                space = line.find(b' ')
+                if space == -1:
+                    cmd, arg = line.upper(), ""
+                else:
+                    cmd, arg = line[:space].upper(), line[space + 1:].decode('utf-8')
+
+                if not self.authenticated and cmd not in (b"USER", b"PASS", b"QUIT"):
+                    await self.send(b"530 Please login with USER and PASS.\r\n")
                     continue
-                elif cmd == "PWD":
-                    rel_path = "/" + os.path.relpath(self.cwd, self.root_dir).replace("\\", "/")
-                    if rel_path == "/.": rel_path = "/"
-                    self.send(f'257 "{rel_path}"')
-                elif cmd == "CWD":
-                    new_path = os.path.join(self.cwd, arg)
-                    if os.path.isdir(new_path) and os.path.abspath(new_path).startswith(self.root_dir):
-                        self.cwd = new_path
-                        self.send("250 Directory successfully changed.")
-                    else:
-                        self.send("550 Failed to change directory.")
-                elif cmd == "TYPE":
-                    self.send("200 Switching to Binary mode.")
-                elif cmd == "PASV":
-                    self.start_pasv()
-                elif cmd == "PORT":
-                    self.handle_port(arg)
-                elif cmd == "LIST":
-                    self.handle_list()
-                elif cmd == "RETR":
-                    self.handle_retr(arg)
-                elif cmd == "STOR":
-                    self.handle_stor(arg)
-                elif cmd == "QUIT":
-                    self.send("221 Goodbye.")
+                # Returns True when the session should end (QUIT)
+                if await self.DISPATCH.get(cmd, FTPHandler.handle_unknown)(self, arg):
                     break
-                else:
-                    self.send("502 Command not implemented.")
             except Exception as e:
                 print(f"Handler Error: {e}")
                 break
         self.close_data()
-        self.sock.close()
+        self.writer.close()
+
+    async def handle_user(self, arg):
+        await self.send(b"331 Please specify the password.\r\n")
 
-    def start_pasv(self):
-        self.pasv_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.pasv_sock.bind(('0.0.0.0', 0))
-        self.pasv_sock.listen(1)
+    async def handle_pass(self, arg):
+        self.authenticated = True # Accept any password for demo
+        await self.send(b"230 Login successful.\r\n")
+
+    async def handle_pwd(self, arg):
+        await self.send(f'257 "{self.cwd_rel}"')
+
+    async def handle_cwd(self, arg):
+        # Resolve purely on the virtual path; anything climbing above root is rejected
+        new_rel = posixpath.normpath(posixpath.join(self.cwd_rel, arg).lstrip('/') or '.')
+        new_path = self.root_dir if new_rel == '.' else os.path.abspath(os.path.join(self.root_dir, new_rel))
+        if new_rel == '..' or new_rel.startswith('../'):
+            inside = False
+        else:
+            # Native check too: on Windows '..\\..' or 'C:\\' slip past the posix one
+            try:
+                inside = os.path.commonpath([self.root_dir, new_path]) == self.root_dir
+            except ValueError: # different drives
+                inside = False
+        if inside and os.path.isdir(new_path):
+            self.cwd = new_path
+            self.cwd_rel = "/" if new_rel == '.' else "/" + new_rel
+            await self.send(b"250 Directory successfully changed.\r\n")
+        else:
+            await self.send(b"550 Failed to change directory.\r\n")
+
+    async def handle_type(self, arg):
+        await self.send(b"200 Switching to Binary mode.\r\n")
+
+    async def handle_quit(self, arg):
+        await self.send(b"221 Goodbye.\r\n")
+        return True
+
+    async def handle_unknown(self, arg):
+        await self.send(b"502 Command not implemented.\r\n")
+
+    async def start_pasv(self, arg=""):
+        self.close_data()
+        self.pasv_sock = self.pasv_pool.acquire()
         port = self.pasv_sock.getsockname()[1]
-        ip = '127,0,0,1' # Hardcoded for local demo
+        # Advertise the address the client reached us on
+        ip = self.writer.get_extra_info('sockname')[0].replace('.', ',')
         p1, p2 = port // 256, port % 256
-        self.send(f"227 Entering Passive Mode ({ip},{p1},{p2}).")
+        await self.send(f"227 Entering Passive Mode ({ip},{p1},{p2}).")
         self.pasv_mode = True
 
-    def handle_port(self, arg):
+    async def handle_port(self, arg):
         # PORT h1,h2,h3,h4,p1,p2
         parts = arg.split(',')
         ip = '.'.join(parts[:4])
         port = int(parts[4]) * 256 + int(parts[5])
         self.data_addr = (ip, port)
         self.pasv_mode = False
-        self.send("200 PORT command successful.")
+        await self.send(b"200 PORT command successful.\r\n")
 
-    def open_data_conn(self):
-        if self.pasv_mode:
-            conn, addr = self.pasv_sock.accept()
-            self.pasv_sock.close()
+    async def open_data_conn(self):
+        # Data sockets stay non-blocking and are driven by the loop's sock_* helpers
+        loop = asyncio.get_running_loop()
+        if self.pasv_mode and self.pasv_sock:
+            # Only accept the data connection from the host on the control connection
+            peer_ip = self.writer.get_extra_info('peername')[0]
+            while True:
+                conn, addr = await loop.sock_accept(self.pasv_sock)
+                if addr[0] == peer_ip: break
+                conn.close()
+            self.pasv_pool.release(self.pasv_sock)
             self.pasv_sock = None
-            return conn
         elif self.data_addr:
             conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            conn.connect(self.data_addr)
-            return conn
-        return None
+            conn.setblocking(False)
+            await loop.sock_connect(conn, self.data_addr)
+        else:
+            return None
+        conn.setblocking(False)
+        self.data_sock = conn
+        return conn
 
     def close_data(self):
         if self.data_sock:
             self.data_sock.close()
             self.data_sock = None
+        if self.pasv_sock:
+            self.pasv_pool.release(self.pasv_sock)
+            self.pasv_sock = None
 
-    def handle_list(self):
-        self.send("150 Here comes the directory listing.")
-        conn = self.open_data_conn()
+    async def handle_list(self, arg=""):
+        await self.send(b"150 Here comes the directory listing.\r\n")
+        conn = await self.open_data_conn()
         if conn:
-            files = os.listdir(self.cwd)
-            for f in files:
-                # Minimal LIST format
-                conn.sendall(f"{f}\r\n".encode('utf-8'))
-            conn.close()
-            self.send("226 Directory send OK.")
+            loop = asyncio.get_running_loop()
+            buf = await loop.run_in_executor(None, build_listing, self.cwd)
+            await loop.sock_sendall(conn, buf)
+            self.close_data()
+            await self.send(b"226 Directory send OK.\r\n")
         else:
-            self.send("425 Use PORT or PASV first.")
+            await self.send(b"425 Use PORT or PASV first.\r\n")
 
-    def handle_retr(self, filename):
+    async def handle_retr(self, filename):
         path = os.path.join(self.cwd, filename)
-        if os.path.exists(path):
-            self.send("150 Opening data connection for file download.")
-            conn = self.open_data_conn()
+        try:
+            f = open(path, 'rb') # One syscall doubles as the existence check
+        except OSError:
+            await self.send(b"550 File not found.\r\n")
+            return
+        with f:
+            await self.send(b"150 Opening data connection for file download.\r\n")
+            conn = await self.open_data_conn()
             if conn:
-                with open(path, 'rb') as f:
-                    while True:
-                        data = f.read(4096)
-                        if not data: break
-                        conn.sendall(data)
-                conn.close()
-                self.send("226 Transfer complete.")
+                conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+                # Cork so the kernel only emits full-sized segments; uncorking flushes the tail
+                cork = getattr(socket, 'TCP_CORK', None) # Linux only
+                if cork is not None:
+                    conn.setsockopt(socket.IPPROTO_TCP, cork, 1)
+                # Zero-copy via os.sendfile where available, read/send fallback otherwise
+                await asyncio.get_running_loop().sock_sendfile(conn, f)
+                if cork is not None:
+                    conn.setsockopt(socket.IPPROTO_TCP, cork, 0)
+                self.close_data()
+                await self.send(b"226 Transfer complete.\r\n")
             else:
-                self.send("425 Use PORT or PASV first.")
-        else:
-            self.send("550 File not found.")
+                await self.send(b"425 Use PORT or PASV first.\r\n")
 
-    def handle_stor(self, filename):
+    async def handle_stor(self, filename):
         path = os.path.join(self.cwd, filename)
-        self.send("150 Opening data connection for file upload.")
-        conn = self.open_data_conn()
+        await self.send(b"150 Opening data connection for file upload.\r\n")
+        conn = await self.open_data_conn()
         if conn:
-            with open(path, 'wb') as f:
-                while True:
-                    data = conn.recv(4096)
-                    if not data: break
-                    f.write(data)
-            conn.close()
-            self.send("226 Transfer complete.")
+            loop = asyncio.get_running_loop()
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+            fd = await loop.run_in_executor(None, os.open, path, flags, 0o644)
+            try:
+                if not await self.splice_to_file(conn, fd):
+                    # Reuse one buffer for the whole upload instead of a bytes object per chunk
+                    buf = bytearray(65536)
+                    mv = memoryview(buf)
+                    while True:
+                        n = await loop.sock_recv_into(conn, mv)
+                        if not n: break
+                        await loop.run_in_executor(None, os.write, fd, mv[:n])
+            finally:
+                os.close(fd)
+            self.close_data()
+            await self.send(b"226 Transfer complete.\r\n")
         else:
-            self.send("425 Use PORT or PASV first.")
+            await self.send(b"425 Use PORT or PASV first.\r\n")
+
+    async def splice_to_file(self, conn, fd):
+        # Linux only: move socket data into the file through a kernel pipe so it never
+        # enters Python. Returns False (nothing consumed) if splice can't be used here.
+        if not hasattr(os, 'splice'):
+            return False
+        loop = asyncio.get_running_loop()
+        r, w = os.pipe()
+        try:
+            try:
+                fcntl.fcntl(w, fcntl.F_SETPIPE_SZ, 1 << 20)
+            except (OSError, AttributeError):
+                pass # Keep the default 64 KiB pipe
+            moved_any = False
+            file_splice = True
+            while True:
+                try:
+                    n = os.splice(conn.fileno(), w, 1 << 20, flags=os.SPLICE_F_MOVE)
+                except BlockingIOError:
+                    readable = loop.create_future()
+                    loop.add_reader(conn.fileno(), lambda: readable.done() or readable.set_result(None))
+                    try:
+                        await readable
+                    finally:
+                        loop.remove_reader(conn.fileno())
+                    continue
+                except OSError:
+                    if moved_any: raise
+                    return False
+                if not n: break
+                moved_any = True
+                # The file write may block on disk, so keep it off the event loop
+                file_splice = await loop.run_in_executor(None, drain_pipe, r, fd, n, file_splice)
+            return True
+        finally:
+            os.close(r)
+            os.close(w)
+
+    # Command name (bytes) -> handler; every handler takes the argument string
+    DISPATCH = {
+        b"USER": handle_user,
+        b"PASS": handle_pass,
+        b"PWD": handle_pwd,
+        b"CWD": handle_cwd,
+        b"TYPE": handle_type,
+        b"PASV": start_pasv,
+        b"PORT": handle_port,
+        b"LIST": handle_list,
+        b"RETR": handle_retr,
+        b"STOR": handle_stor,
+        b"QUIT": handle_quit,
+    }
 
 if __name__ == "__main__":
     server = CustomFTPServer()
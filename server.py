@@ -17,21 +17,45 @@ Key Features:
 """
 
 import os
-import json
+import atexit
 import asyncio
+import queue
 import threading
 import socket
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 
 # Directory paths for data storage
 LOG_DIR = os.path.join("data", "logs")              # Server activity logs
 FILES_DIR = os.path.join("data", "files")           # Uploaded files storage
-METADATA_FILE = os.path.join("data", "files_metadata.json")  # File ownership tracking
+METADATA_DB = os.path.join("data", "metadata.db")  # File ownership tracking (SQLite)
+LEGACY_METADATA_FILE = os.path.join("data", "files_metadata.json")  # Pre-SQLite ownership file, imported once then renamed
+
+# Uploads are streamed to disk in chunks; blocking writes run on a dedicated pool
+UPLOAD_CHUNK_SIZE = 1 << 20
+upload_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="upload")
+
+
+def _dumps(obj) -> str:
+    """
+    Serialize an object to a JSON string using orjson.
+    
+    Args:
+        obj: JSON-serializable object (dict, list, str, ...)
+    
+    orjson encodes straight to UTF-8 bytes in C; decoding those bytes is still
+    much cheaper than the stdlib json encoder. Use orjson.dumps directly where
+    bytes are wanted (HTTP bodies, files).
+    """
+    return orjson.dumps(obj).decode("utf-8")
 
 
 def ensure_dir(path):
@@ -44,6 +68,47 @@ def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
 
+# Log lines are queued here and written by a background thread,
+# so request handlers and the event loop never block on disk
+_LOG_Q: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+LOG_BATCH_SIZE = 64
+
+
+def _log_writer():
+    """
+    Background thread: append queued log lines to server.log.
+    
+    Keeps the log file open, drains up to LOG_BATCH_SIZE lines per write and
+    flushes once per batch. A None in the queue flushes and stops the thread.
+    """
+    ensure_dir(LOG_DIR)
+    with open(os.path.join(LOG_DIR, "server.log"), "a", encoding="utf-8") as f:
+        running = True
+        while running:
+            lines = [_LOG_Q.get()]
+            while len(lines) < LOG_BATCH_SIZE:
+                try:
+                    lines.append(_LOG_Q.get_nowait())
+                except queue.Empty:
+                    break
+            if None in lines:
+                running = False
+                lines = [line for line in lines if line is not None]
+            f.write("".join(lines))
+            f.flush()
+
+
+_log_thread = threading.Thread(target=_log_writer, name="log-writer", daemon=True)
+_log_thread.start()
+
+
+@atexit.register
+def _stop_log_writer():
+    """Flush pending log lines on interpreter exit."""
+    _LOG_Q.put(None)
+    _log_thread.join(timeout=2)
+
+
 def log_server(message: str):
     """
     Log server activity to file and console.
@@ -52,44 +117,99 @@ def log_server(message: str):
         message: Log message to record
     
     Logs are stored in data/logs/server.log with timestamps.
+    The file write happens on the background log-writer thread.
     """
-    ensure_dir(LOG_DIR)
-    with open(os.path.join(LOG_DIR, "server.log"), "a", encoding="utf-8") as f:
-        f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}\n")
+    _LOG_Q.put(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}\n")
     print(message)
 
 
+# Single shared SQLite connection; writes are serialized by metadata_lock,
+# reads run without it (WAL lets readers proceed alongside a writer)
+_metadata_conn: Optional[sqlite3.Connection] = None
+metadata_lock = threading.Lock()
+
+
+def get_metadata_conn() -> sqlite3.Connection:
+    """
+    Open (once) the SQLite database holding file ownership.
+    
+    Returns:
+        sqlite3.Connection shared by the whole process
+    
+    Creates the files table on first use and imports any ownership records
+    from the old data/files_metadata.json so existing uploads keep their owner.
+    The JSON file is then renamed to files_metadata.json.imported so it is
+    never imported again (deleted files would otherwise regain an owner).
+    """
+    global _metadata_conn
+    if _metadata_conn is None:
+        with metadata_lock:
+            if _metadata_conn is None:
+                ensure_dir(os.path.dirname(METADATA_DB))
+                conn = sqlite3.connect(METADATA_DB, check_same_thread=False, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS files(name TEXT PRIMARY KEY, owner TEXT)")
+                if os.path.exists(LEGACY_METADATA_FILE):
+                    try:
+                        with open(LEGACY_METADATA_FILE, "rb") as f:
+                            legacy = orjson.loads(f.read())
+                        conn.executemany("INSERT OR IGNORE INTO files VALUES (?, ?)", legacy.items())
+                        os.replace(LEGACY_METADATA_FILE, LEGACY_METADATA_FILE + ".imported")
+                    except Exception as e:
+                        log_server(f"[METADATA] could not import {LEGACY_METADATA_FILE}: {e}")
+                _metadata_conn = conn
+    return _metadata_conn
+
+
 def load_metadata():
     """
-    Load file ownership metadata from JSON file.
+    Load all file ownership records.
     
     Returns:
         dict: Mapping of filename -> owner username
               Example: {"document.pdf": "alice", "image.png": "bob"}
+    """
+    return dict(get_metadata_conn().execute("SELECT name, owner FROM files").fetchall())
+
+
+def get_file_owner(filename: str) -> Optional[str]:
+    """
+    Look up the owner of a single file.
+    
+    Args:
+        filename: Name of the file
     
-    Returns empty dict if file doesn't exist or is corrupted.
+    Returns:
+        Owner username, or None if the file has no ownership record.
     """
-    if not os.path.exists(METADATA_FILE):
-        return {}
-    try:
-        with open(METADATA_FILE, "r") as f:
-            return json.load(f)
-    except:
-        return {}
+    row = get_metadata_conn().execute("SELECT owner FROM files WHERE name = ?", (filename,)).fetchone()
+    return row[0] if row else None
 
 
-def save_metadata(metadata):
+def set_file_owner(filename: str, owner: str):
     """
-    Save file ownership metadata to JSON file.
+    Record (or replace) the owner of a file.
     
     Args:
-        metadata: Dictionary mapping filename -> owner username
+        filename: Name of the file
+        owner: Username of the uploader
+    """
+    conn = get_metadata_conn()
+    with metadata_lock:
+        conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?)", (filename, owner))
+
+
+def remove_file_owner(filename: str):
+    """
+    Delete the ownership record of a file (no-op if there is none).
     
-    Creates directory if it doesn't exist.
+    Args:
+        filename: Name of the file
     """
-    ensure_dir(os.path.dirname(METADATA_FILE))
-    with open(METADATA_FILE, "w") as f:
-        json.dump(metadata, f)
+    conn = get_metadata_conn()
+    with metadata_lock:
+        conn.execute("DELETE FROM files WHERE name = ?", (filename,))
 
 
 # ============================================================================
@@ -114,6 +234,60 @@ active_connections: Dict[str, WebSocket] = {}
 # Async lock to prevent race conditions when multiple users connect/disconnect simultaneously
 connections_lock = asyncio.Lock()
 
+# Copy-on-write snapshot of active_connections.values(), republished on every join/leave.
+# Readers grab the current tuple without taking connections_lock.
+active_snapshot: Tuple[WebSocket, ...] = ()
+
+# Caps how many sends a broadcast runs at once, and how long (seconds) one slow client may stall it
+BROADCAST_SEM = asyncio.Semaphore(256)
+BROADCAST_SEND_TIMEOUT = 1.0
+
+# Cached user list and its encoded forms, rebuilt lazily after a join/leave clears it
+# Example: {"list": ["alice", "bob"], "http": b'{"users": [...]}', "ws": '{"type": "users", ...}'}
+_users_cache: Optional[Dict[str, Any]] = None
+
+
+def invalidate_users_cache():
+    """
+    Drop the cached user list. Must be called whenever active_connections changes.
+    """
+    global _users_cache
+    _users_cache = None
+
+
+def publish_connections():
+    """
+    Publish a change to active_connections (call while holding connections_lock).
+    
+    Rebuilds active_snapshot and drops the cached user list.
+    """
+    global active_snapshot
+    active_snapshot = tuple(active_connections.values())
+    invalidate_users_cache()
+
+
+def get_users_cache() -> Dict[str, Any]:
+    """
+    Get the current user list together with its pre-encoded JSON responses.
+    
+    Returns:
+        dict with keys:
+        - list: usernames in connection order
+        - http: body of GET /users as bytes
+        - ws: reply to a WebSocket "users" request as text
+    
+    The list is copied and encoded once per join/leave instead of on every request.
+    """
+    global _users_cache
+    if _users_cache is None:
+        users = list(active_connections.keys())
+        _users_cache = {
+            "list": users,
+            "http": orjson.dumps({"users": users}),
+            "ws": _dumps({"type": "users", "users": users}),
+        }
+    return _users_cache
+
 
 # ============================================================================
 # HTTP Endpoints
@@ -138,8 +312,7 @@ async def list_users():
     Returns:
         JSON: {"users": ["alice", "bob", "charlie"]}
     """
-    async with connections_lock:
-        return {"users": list(active_connections.keys())}
+    return Response(content=get_users_cache()["http"], media_type="application/json")
 
 
 async def broadcast(message: dict):
@@ -149,13 +322,23 @@ async def broadcast(message: dict):
     Args:
         message: Dictionary to send (will be JSON serialized)
     
-    Uses asyncio.gather to send to all users concurrently.
+    The message is JSON-encoded once and the same payload is sent to every user.
+    Sends run concurrently via asyncio.gather, bounded by BROADCAST_SEM, and each
+    send is given BROADCAST_SEND_TIMEOUT seconds so a slow client can't hold it up.
     Exceptions are caught to prevent one failed send from affecting others.
     """
-    async with connections_lock:
-        send_tasks = [ws.send_text(json.dumps(message)) for ws in active_connections.values()]
-    if send_tasks:
-        await asyncio.gather(*send_tasks, return_exceptions=True)
+    payload = _dumps(message)
+
+    async def _send(ws: WebSocket):
+        async with BROADCAST_SEM:
+            try:
+                await asyncio.wait_for(ws.send_text(payload), BROADCAST_SEND_TIMEOUT)
+            except Exception:
+                pass
+
+    snapshot = active_snapshot
+    if snapshot:
+        await asyncio.gather(*(_send(ws) for ws in snapshot))
 
 
 async def send_to_user(username: str, message: dict):
@@ -169,11 +352,10 @@ async def send_to_user(username: str, message: dict):
     If user is not connected, message is silently dropped.
     Errors are logged but don't raise exceptions.
     """
-    async with connections_lock:
-        ws = active_connections.get(username)
+    ws = active_connections.get(username)
     if ws:
         try:
-            await ws.send_text(json.dumps(message))
+            await ws.send_text(_dumps(message))
         except Exception as e:
             log_server(f"[SEND_ERROR] to {username}: {e}")
 
@@ -215,17 +397,18 @@ async def websocket_endpoint(websocket: WebSocket):
     # Check for duplicate username (prevent identity conflicts)
     async with connections_lock:
         if username in active_connections:
-            await websocket.send_text(json.dumps({"type": "error", "message": "Username already connected."}))
+            await websocket.send_text(_dumps({"type": "error", "message": "Username already connected."}))
             await websocket.close(code=1008)
             return
         # Add user to active connections
         active_connections[username] = websocket
+        publish_connections()
     
     # Log the join event
     log_server(f"[JOIN] {username}")
     
     # Notify all users about the new user (includes updated user list)
-    await broadcast({"type": "info", "message": f"{username} joined", "users": list(active_connections.keys())})
+    await broadcast({"type": "info", "message": f"{username} joined", "users": get_users_cache()["list"]})
 
     # Main message loop - listen for incoming messages
     try:
@@ -235,9 +418,9 @@ async def websocket_endpoint(websocket: WebSocket):
             
             # Parse JSON message
             try:
-                data = json.loads(raw)
-            except json.JSONDecodeError:
-                await websocket.send_text(json.dumps({"type": "error", "message": "Invalid JSON."}))
+                data = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                await websocket.send_text(_dumps({"type": "error", "message": "Invalid JSON."}))
                 continue
 
             # Route message based on type
@@ -254,7 +437,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 to = data.get("to")
                 text = data.get("message", "")
                 if not to:
-                    await websocket.send_text(json.dumps({"type": "error", "message": "Missing 'to' for direct message."}))
+                    await websocket.send_text(_dumps({"type": "error", "message": "Missing 'to' for direct message."}))
                     continue
                 # Send only to recipient (NOT to sender - client handles that)
                 await send_to_user(to, {"type": "message", "from": username, "message": text, "is_direct": True})
@@ -262,13 +445,11 @@ async def websocket_endpoint(websocket: WebSocket):
                 
             elif msg_type == "users":
                 # Client requesting current user list
-                async with connections_lock:
-                    users = list(active_connections.keys())
-                await websocket.send_text(json.dumps({"type": "users", "users": users}))
+                await websocket.send_text(get_users_cache()["ws"])
                 
             else:
                 # Unknown message type
-                await websocket.send_text(json.dumps({"type": "error", "message": "Unknown message type."}))
+                await websocket.send_text(_dumps({"type": "error", "message": "Unknown message type."}))
                 
     except WebSocketDisconnect:
         # Client disconnected (normal closure)
@@ -278,12 +459,13 @@ async def websocket_endpoint(websocket: WebSocket):
         async with connections_lock:
             if username in active_connections and active_connections[username] is websocket:
                 del active_connections[username]
+                publish_connections()
         
         # Log the leave event
         log_server(f"[LEAVE] {username}")
         
         # Notify all remaining users
-        await broadcast({"type": "info", "message": f"{username} left", "users": list(active_connections.keys())})
+        await broadcast({"type": "info", "message": f"{username} left", "users": get_users_cache()["list"]})
 
 
 # ============================================================================
@@ -391,7 +573,7 @@ async def upload_file(file: UploadFile = File(...), username: str = Form(...)):
     
     Process:
     1. Save file to data/files/ directory
-    2. Record ownership in metadata.json
+    2. Record ownership in the metadata database
     3. Log the upload
     4. Return success response
     
@@ -403,15 +585,17 @@ async def upload_file(file: UploadFile = File(...), username: str = Form(...)):
         # Construct file path
         file_path = os.path.join(FILES_DIR, file.filename)
         
-        # Save file to disk
+        # Stream file to disk chunk by chunk (memory stays bounded to one chunk)
+        loop = asyncio.get_running_loop()
         with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await loop.run_in_executor(upload_executor, buffer.write, chunk)
         
         # Record ownership in metadata
-        metadata = load_metadata()
-        metadata[file.filename] = username
-        save_metadata(metadata)
+        set_file_owner(file.filename, username)
         
         # Log the upload
         log_server(f"[UPLOAD] {username} uploaded {file.filename}")
@@ -430,16 +614,15 @@ async def delete_file(filename: str, username: str):
         username: Username of requester (query parameter)
     
     Security:
+    - Validates ownership (403 if not owner) before touching the filesystem
     - Validates file exists (404 if not)
-    - Validates ownership (403 if not owner)
     - Only owner can delete their files
     
     Process:
-    1. Check if file exists
-    2. Load metadata and get owner
-    3. Compare owner with requester
-    4. If match: delete file and update metadata
-    5. If no match: return 403 Forbidden
+    1. Load metadata and get owner
+    2. Compare owner with requester
+    3. If no match: return 403 Forbidden (404 if the file doesn't exist at all)
+    4. If match: unlink the file (404 if already gone) and update metadata
     
     Returns:
         200: {"message": "File deleted successfully"}
@@ -450,25 +633,25 @@ async def delete_file(filename: str, username: str):
         # Construct file path
         file_path = os.path.join(FILES_DIR, filename)
         
-        # Check if file exists
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="File not found")
-            
-        # Load metadata to check ownership
-        metadata = load_metadata()
-        owner = metadata.get(filename)
+        # Look up the owner to check ownership
+        owner = get_file_owner(filename)
         
         # Validate ownership (SECURITY CHECK)
         if owner != username:
+            # Only the rejection path pays for an existence check, to report 404 over 403
+            if owner is None and not os.path.exists(file_path):
+                raise HTTPException(status_code=404, detail="File not found")
             raise HTTPException(status_code=403, detail="You can only delete your own files")
             
-        # Delete file from filesystem
-        os.remove(file_path)
+        # Delete file from filesystem (single syscall; no exists/remove race)
+        try:
+            os.unlink(file_path)
+        except FileNotFoundError:
+            remove_file_owner(filename)  # Stale record for a file that's already gone
+            raise HTTPException(status_code=404, detail="File not found")
         
         # Remove from metadata
-        if filename in metadata:
-            del metadata[filename]
-            save_metadata(metadata)
+        remove_file_owner(filename)
             
         # Log the deletion
         log_server(f"[DELETE] {username} deleted {filename}")